@@ -12,6 +12,7 @@ STORAGE_DIR = os.path.join(BASE_DIR, "storage")
 CHROMA_PATH = os.path.join(STORAGE_DIR, "chroma_db")
 LOG_DIR = os.path.join(STORAGE_DIR, "logs")
 RERANKER_CACHE = os.path.join(STORAGE_DIR, "reranker_cache")
+EMBEDDING_CACHE_PATH = os.path.join(STORAGE_DIR, "embedding_cache.sqlite3")
 DEFAULT_KB_NAME = "source_documents"
 
 
@@ -53,6 +54,16 @@ BM25_TOP_K = int(os.getenv("BM25_TOP_K", "20"))
 FINAL_TOP_K = int(os.getenv("FINAL_TOP_K", "5"))
 RRF_K = int(os.getenv("RRF_K", "60"))
 
+# ==================== 问答缓存 ====================
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # 秒
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "100"))
+# 语义命中阈值（问题向量余弦相似度）
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+
+# ==================== 向量缓存（磁盘持久化，重启后仍有效）====================
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "500"))
+
 
 # ==================== Reranker 配置 ====================
 class RerankerType(Enum):
@@ -1,8 +1,10 @@
 # src/core/custom_llm.py
-from typing import Any, Sequence, List
+import json
+from typing import Any, Sequence, List, Iterator, Tuple
 from llama_index.core.llms import (
     CustomLLM,
     ChatResponse,
+    ChatResponseGen,
     CompletionResponse,
     CompletionResponseGen,
     LLMMetadata,
@@ -49,13 +51,7 @@ class GenericOpenAILLM(CustomLLM):
     # ✅ chat 返回 ChatResponse -> 必须使用 llm_chat_callback
     @llm_chat_callback()
     def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
-        # 将 LlamaIndex 消息对象转为 API 字典
-        api_messages = [
-            {"role": msg.role.value if hasattr(msg.role, 'value') else str(msg.role),
-             "content": msg.content}
-            for msg in messages
-        ]
-
+        api_messages = self._to_api_messages(messages)
         response_text = self._call_api(api_messages, **kwargs)
 
         return ChatResponse(
@@ -63,12 +59,34 @@ class GenericOpenAILLM(CustomLLM):
             raw={"model": self.model, "usage": {}}
         )
 
-    # ✅ stream_chat 也应该对应 chat callback (虽然这里未实现)
+    # ✅ stream_chat 也对应 chat callback
     @llm_chat_callback()
-    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> CompletionResponseGen:
-        raise NotImplementedError("流式聊天暂不支持")
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        api_messages = self._to_api_messages(messages)
+
+        def gen() -> ChatResponseGen:
+            content = ""
+            for delta in self._stream_api(api_messages, **kwargs):
+                content += delta
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=content),
+                    delta=delta,
+                    raw={"model": self.model}
+                )
+
+        return gen()
+
+    @staticmethod
+    def _to_api_messages(messages: Sequence[ChatMessage]) -> List[dict]:
+        """将 LlamaIndex 消息对象转为 API 字典"""
+        return [
+            {"role": msg.role.value if hasattr(msg.role, 'value') else str(msg.role),
+             "content": msg.content}
+            for msg in messages
+        ]
 
-    def _call_api(self, messages: List[dict], **kwargs) -> str:
+    def _build_request(self, messages: List[dict], **kwargs) -> Tuple[str, dict, dict]:
+        """构建请求的 (url, headers, payload)"""
         url = f"{self.api_base.rstrip('/')}/chat/completions"
 
         headers = {
@@ -85,6 +103,47 @@ class GenericOpenAILLM(CustomLLM):
             "temperature": kwargs.get("temperature", self.temperature),
             "max_tokens": kwargs.get("max_tokens", self.max_tokens),
         }
+        return url, headers, payload
+
+    def _stream_api(self, messages: List[dict], **kwargs) -> Iterator[str]:
+        """流式调用 API（SSE），逐个返回增量文本"""
+        url, headers, payload = self._build_request(messages, **kwargs)
+        payload["stream"] = True
+
+        try:
+            with requests.post(
+                    url, headers=headers, json=payload, timeout=self.timeout, stream=True
+            ) as response:
+                response.raise_for_status()
+                # SSE 响应常不声明 charset，按字节读取后统一用 UTF-8 解码
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    line = line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    choices = chunk.get("choices") or []
+                    if not choices:
+                        continue
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 429:
+                raise RuntimeError("API 请求频率过高 (429)，请稍后重试。")
+            else:
+                raise RuntimeError(f"API 调用失败: {e}")
+        except Exception as e:
+            raise RuntimeError(f"请求异常: {e}")
+
+    def _call_api(self, messages: List[dict], **kwargs) -> str:
+        url, headers, payload = self._build_request(messages, **kwargs)
 
         try:
             response = requests.post(
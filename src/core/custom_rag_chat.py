@@ -1,10 +1,16 @@
 # src/core/custom_rag_chat.py
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 from llama_index.core import Settings
 from llama_index.core.llms import ChatMessage, MessageRole
 from src.core.hybrid_retriever import hybrid_retrieve
 from src.core.logger import log, error
 import hashlib
+import re
+
+# 回答与来源引用之间的分隔标记（前端据此拆分出“参考来源”）
+SOURCES_HEADER = "**🔍 检索到的上下文:**"
+SOURCES_SEPARATOR = f"\n\n---\n\n{SOURCES_HEADER}"
+ERROR_REPLY = "抱歉，生成响应时出现错误，请稍后重试。"
 
 
 class CustomRAGChat:
@@ -12,6 +18,7 @@ class CustomRAGChat:
     自定义 RAG 聊天实现
     已移除不稳定的"是否需要检索"判断逻辑，改为强制检索，确保回答准确性。
     """
+    STREAM_CHUNK_CHARS = 4  # 流式输出时每次至少攒够的字符数
 
     def __init__(self, kb_name: str, index):
         self.kb_name = kb_name
@@ -80,11 +87,17 @@ class CustomRAGChat:
 
         return result
 
-    def chat(self, user_input: str, history: List[Tuple[str, str]], max_history: int = 5) -> str:
-        """主聊天方法"""
-        if not user_input.strip():
-            return "请输入有效的问题"
-
+    def _build_messages(
+            self,
+            user_input: str,
+            history: List[Tuple[str, str]],
+            max_history: int
+    ) -> Tuple[List[ChatMessage], str]:
+        """
+        检索上下文并构建发送给 LLM 的消息
+        Returns:
+            Tuple[List[ChatMessage], str]: (消息列表, 用于UI显示的带格式上下文)
+        """
         # =======================================================
         # 核心修改：强制每次都进行检索
         # =======================================================
@@ -113,15 +126,29 @@ class CustomRAGChat:
         recent_history = history[-max_history:]
         for user_msg, bot_msg in recent_history:
             # 清理历史消息中的引用部分，减少 Token 消耗并防止干扰
-            clean_bot_msg = bot_msg.split("\n\n---\n\n**🔍 检索到的上下文:**")[0]
+            clean_bot_msg = bot_msg.split(SOURCES_SEPARATOR)[0]
             # 同样清理 HTML 标签（如果有残留）
-            import re
             clean_bot_msg = re.sub(r'<[^>]+>', '', clean_bot_msg)
 
             messages.append(ChatMessage(role=MessageRole.USER, content=user_msg))
             messages.append(ChatMessage(role=MessageRole.ASSISTANT, content=clean_bot_msg))
 
         messages.append(ChatMessage(role=MessageRole.USER, content=user_input))
+        return messages, display_context_str
+
+    @staticmethod
+    def _sources_suffix(content: str, display_context_str: str) -> str:
+        """来源引用部分（知识库无相关信息时不附加）"""
+        if display_context_str and "知识库中未找到相关信息" not in content:
+            return f"{SOURCES_SEPARATOR}\n{display_context_str}"
+        return ""
+
+    def chat(self, user_input: str, history: List[Tuple[str, str]], max_history: int = 5) -> str:
+        """主聊天方法"""
+        if not user_input.strip():
+            return "请输入有效的问题"
+
+        messages, display_context_str = self._build_messages(user_input, history, max_history)
 
         # 3. 生成响应
         try:
@@ -137,15 +164,64 @@ class CustomRAGChat:
             # ==========================================
 
             # 4. 组合最终输出（答案 + 来源引用）
-            if display_context_str and "知识库中未找到相关信息" not in content:
-                final_response = f"{content}\n\n---\n\n**🔍 检索到的上下文:**\n{display_context_str}"
-            else:
-                final_response = content
+            return content + self._sources_suffix(content, display_context_str)
 
-            return final_response
+        except Exception as e:
+            error(f"LLM生成响应失败: {e}")
+            import traceback
+            traceback.print_exc()
+            return ERROR_REPLY
+
+    def stream_chat(
+            self,
+            user_input: str,
+            history: List[Tuple[str, str]],
+            max_history: int = 5
+    ) -> Iterator[str]:
+        """
+        流式聊天
+        逐块返回答案文本（攒够 STREAM_CHUNK_CHARS 个字符再输出，避免界面抖动），
+        来源引用作为最后一个独立的块返回，以 SOURCES_SEPARATOR 开头
+        """
+        if not user_input.strip():
+            yield "请输入有效的问题"
+            return
+
+        messages, display_context_str = self._build_messages(user_input, history, max_history)
+
+        content = ""
+        buffer = ""
+        try:
+            try:
+                stream = Settings.llm.stream_chat(messages)
+            except NotImplementedError:
+                # LLM 不支持流式时退回一次性生成
+                stream = [Settings.llm.chat(messages)]
+
+            for chunk in stream:
+                delta = chunk.delta if chunk.delta is not None else chunk.message.content
+                if not delta:
+                    continue
+                content += delta
+                buffer += delta
+                if len(buffer) >= self.STREAM_CHUNK_CHARS:
+                    yield buffer
+                    buffer = ""
+
+            if buffer:
+                yield buffer
 
         except Exception as e:
             error(f"LLM生成响应失败: {e}")
             import traceback
             traceback.print_exc()
-            return "抱歉，生成响应时出现错误，请稍后重试。"
+            yield ("\n\n" if content else "") + ERROR_REPLY
+            return
+
+        log("=" * 50)
+        log(f"🤖 [LLM 生成详情]\n{content}")
+        log("=" * 50)
+
+        suffix = self._sources_suffix(content, display_context_str)
+        if suffix:
+            yield suffix
@@ -0,0 +1,174 @@
+# src/core/embedding_cache.py
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from pydantic import PrivateAttr
+from src.core.logger import log, warn
+
+
+class EmbeddingDiskCache:
+    """
+    持久化的向量缓存（SQLite，进程重启后仍然有效）
+
+    - 键: sha256(模型名 + 类型 + 文本)，值: float32 向量字节
+    - 总大小超过上限时按写入时间淘汰最早的条目
+    - 线程安全（单连接 + 锁）
+    """
+    # 每写入多少条检查一次容量
+    EVICT_CHECK_INTERVAL = 256
+
+    def __init__(self, path: str, max_bytes: int = 500 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vec BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_created ON embeddings(created)")
+        self._conn.commit()
+        self._writes_since_check = 0
+
+    @staticmethod
+    def make_key(model: str, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x1f{kind}\x1f{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """批量读取，未命中的位置为 None"""
+        if not keys:
+            return []
+
+        found = {}
+        with self._lock:
+            # SQLite 变量数有上限，分批查询
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        if not keys:
+            return
+
+        now = time.time()
+        rows = [
+            (key, np.asarray(vec, dtype=np.float32).tobytes(), now)
+            for key, vec in zip(keys, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, created) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+            self._writes_since_check += len(rows)
+            if self._writes_since_check >= self.EVICT_CHECK_INTERVAL:
+                self._writes_since_check = 0
+                self._evict()
+
+    def _evict(self):
+        """超出容量时删除最早写入的条目，直到低于上限的 90%（调用方需持有锁）"""
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for key, size in self._conn.execute(
+                "SELECT key, LENGTH(vec) FROM embeddings ORDER BY created"
+        ).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        self._conn.commit()
+        log(f"🧹 向量缓存淘汰 {removed} 条")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    给任意 Embedding 模型加一层磁盘缓存
+    查询与文档入库都会先查缓存，只对未命中的文本调用真实模型
+    """
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingDiskCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingDiskCache, **data):
+        data.setdefault("model_name", getattr(inner, "model", None) or inner.model_name)
+        data.setdefault("embed_batch_size", inner.embed_batch_size)
+        super().__init__(**data)
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        key = self._cache.make_key(self.model_name, "query", query)
+        try:
+            cached = self._cache.get_many([key])[0]
+            if cached is not None:
+                return cached
+        except Exception as e:
+            warn(f"读取向量缓存失败: {e}")
+
+        embedding = self._inner._get_query_embedding(query)
+        self._safe_put([key], [embedding])
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._cache.make_key(self.model_name, "text", text) for text in texts]
+        try:
+            results = self._cache.get_many(keys)
+        except Exception as e:
+            warn(f"读取向量缓存失败: {e}")
+            results = [None] * len(texts)
+
+        missing = [i for i, vec in enumerate(results) if vec is None]
+        if missing:
+            embeddings = self._inner._get_text_embeddings([texts[i] for i in missing])
+            for i, embedding in zip(missing, embeddings):
+                results[i] = embedding
+            self._safe_put([keys[i] for i in missing], embeddings)
+
+        return results
+
+    def _safe_put(self, keys: List[str], vectors: List[List[float]]):
+        try:
+            self._cache.put_many(keys, vectors)
+        except Exception as e:
+            warn(f"写入向量缓存失败: {e}")
@@ -9,6 +9,7 @@ from llama_index.core import Settings
 from llama_index.llms.ollama import Ollama
 from llama_index.embeddings.ollama import OllamaEmbedding
 from src.core.custom_embedding import OpenRouterEmbedding
+from src.core.embedding_cache import CachedEmbedding, EmbeddingDiskCache
 from llama_index.core.postprocessor import SentenceTransformerRerank
 from config.settings import *
 from llama_index.core.node_parser import SentenceSplitter
@@ -163,6 +164,13 @@ def _init_embedding():
         else:
             raise ValueError(f"❌ 未知的 Provider: {PROVIDER}")
 
+        if EMBEDDING_CACHE_ENABLED and Settings.embed_model is not None:
+            Settings.embed_model = CachedEmbedding(
+                Settings.embed_model,
+                EmbeddingDiskCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+            )
+            log(f"Embedding 磁盘缓存: {EMBEDDING_CACHE_PATH}（上限 {EMBEDDING_CACHE_MAX_MB}MB）")
+
     except Exception as e:
         error(f"❌ Embedding 初始化失败: {e}")
         raise
@@ -1,9 +1,13 @@
 # src/core/rag_pipeline.py
+import hashlib
 import os
 import shutil
+import threading
 import time
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
 from llama_index.core import SimpleDirectoryReader, Settings
+from llama_index.core.schema import MetadataMode
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from config.settings import DEFAULT_KB_NAME, DATA_ROOT
 from config.settings import STORAGE_DIR
@@ -24,13 +28,17 @@ class RAGPipeline:
         '.pdf', '.txt', '.md', '.docx', '.doc',
         '.html', '.htm', '.csv', '.json'
     }
+    MAX_DELETE_WORKERS = 8
+    MAX_UPLOAD_WORKERS = 8
 
     def __init__(self):
-        """初始化仅负责资源检查，不再绑定特定 KB"""
+        """
+        初始化仅负责资源检查，不再绑定特定 KB
+        模型（Embedding/LLM/Reranker）推迟到首次建索引或查询时再加载，加快冷启动
+        """
         try:
-            # 这里调用资源管理器，进行第一次全面初始化
-            if not resource_manager.initialize():
-                raise RuntimeError("资源初始化失败")
+            # 只连接 ChromaDB，连接失败时会抛出 RuntimeError
+            resource_manager.ensure_chroma()
         except Exception as e:
             error(f"❌ 资源初始化异常: {e}")
             raise
@@ -38,8 +46,18 @@ class RAGPipeline:
         # 确保存储目录存在
         os.makedirs(DATA_ROOT, exist_ok=True)
 
+        self._write_lock = threading.Lock()  # 串行化索引写入与持久化
+        self._name_lock = threading.Lock()  # 串行化目标文件名分配
+        self._reserved_paths: Set[str] = set()  # 已分配但尚未拷贝完成的目标路径
+
+    def ensure_models(self):
+        """确保全局模型已加载（首次调用时初始化）"""
+        if not resource_manager.ensure_models():
+            raise RuntimeError("模型初始化失败")
+
     def get_index(self, kb_name: str):
         """获取指定知识库的索引"""
+        self.ensure_models()
         return get_or_build_index(
             kb_name,
             resource_manager.chroma_client,
@@ -78,94 +96,235 @@ class RAGPipeline:
             error(f"查询出错: {e}")
             return f"❌ 系统错误: {str(e)}"
 
-    def upload_files(self, files, target_kb: str) -> str:
+    def query_stream(self, msg: str, kb_name: str, history: List[Tuple[str, str]]) -> Iterator[str]:
+        """
+        流式处理查询，逐块返回回答文本
+        参数同 query；来源引用作为最后一块返回（以 SOURCES_SEPARATOR 开头）
+        """
+        if not msg.strip():
+            yield "请输入有效问题"
+            return
+
+        if not kb_name:
+            yield "❌ 未选择知识库"
+            return
+
+        try:
+            index = self.get_index(kb_name)
+            chat_engine = CustomRAGChat(kb_name, index)
+            yield from chat_engine.stream_chat(msg, history)
+
+        except Exception as e:
+            error(f"查询出错: {e}")
+            yield f"❌ 系统错误: {str(e)}"
+
+    def upload_files(
+            self,
+            files,
+            target_kb: str,
+            batch_size: Optional[int] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> str:
+        """
+        上传并索引文件
+        Args:
+            batch_size: 每个文件向量化时的切片大小（文本块数），None 时整份文件一次提交；
+                        只控制切片，实际每次请求的块数仍由模型的 embed_batch_size 决定
+            progress_callback: 每个文件处理完成后调用 (已完成数, 总数)，在工作线程中执行
+        """
         if not files:
             return "未选择文件"
         if not target_kb:
             return "❌ 未选择目标知识库"
 
-        results = []
-        success_count = 0
-
-        for file in files:
-            file_path = file if isinstance(file, str) else file.name
-            try:
-                result = self.add_document(file_path, target_kb)
-                results.append(result)
-                if "✅" in result:
-                    success_count += 1
-            except Exception as e:
-                error(f"上传文件失败 {file_path}: {e}")
-                results.append(f"❌ {os.path.basename(file_path)}: {str(e)}")
-
-        # 清除相关缓存
-        if success_count > 0:
-            invalidate_bm25_cache(target_kb)
-            # 注意：Index Cache 不需要清除，因为我们是直接操作内存中的 Index 对象
+        file_paths = [file if isinstance(file, str) else file.name for file in files]
+        results, success_count = self._ingest_files(file_paths, target_kb, batch_size, progress_callback)
 
         return f"✅ 成功上传 {success_count}/{len(files)} 个文件\n" + "\n".join(results)
 
     def add_document(self, temp_file_path: str, kb_name: str) -> str:
         """增量添加文档 """
+        results, _ = self._ingest_files([temp_file_path], kb_name)
+        return results[0]
+
+    def _ingest_files(
+            self,
+            file_paths: List[str],
+            kb_name: str,
+            batch_size: Optional[int] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> Tuple[List[str], int]:
+        """
+        增量索引一批文件
+        解析、切分、向量化互不依赖，使用线程池并发执行；
+        写入索引和持久化只做一次，并加锁串行，避免并发写同一个 DocStore
+        Returns:
+            Tuple[List[str], int]: (与 file_paths 一一对应的结果信息, 成功数)
+        """
+        try:
+            self.ensure_models()
+        except Exception as e:
+            error(f"❌ 上传文档处理失败: {e}")
+            return [f"❌ {os.path.basename(path)}: {str(e)}" for path in file_paths], 0
+
+        total = len(file_paths)
+        prepared = [None] * total
+        workers = min(self.MAX_UPLOAD_WORKERS, total)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._prepare_document, path, kb_name, batch_size): i
+                for i, path in enumerate(file_paths)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                prepared[futures[future]] = future.result()
+                if progress_callback:
+                    try:
+                        progress_callback(done, total)
+                    except Exception as e:
+                        warn(f"上传进度回调失败: {e}")
+
+        results = [result for result, _, _ in prepared]
+        ready = [(i, target_path, nodes) for i, (_, target_path, nodes) in enumerate(prepared) if nodes is not None]
+        if not ready:
+            return results, 0
+
+        with self._write_lock:
+            try:
+                index = self.get_index(kb_name)
+                index.insert_nodes([node for _, _, nodes in ready for node in nodes])
+
+                # ✅ 持久化到指定目录 (DocStore)
+                kb_persist_dir = os.path.join(STORAGE_DIR, f"docstore_{kb_name}")
+                os.makedirs(kb_persist_dir, exist_ok=True)
+                index.storage_context.persist(persist_dir=kb_persist_dir)
+
+            except Exception as e:
+                error(f"❌ 上传文档处理失败: {e}")
+                # 写入失败，回滚本批已拷贝的文件以及可能已写入的向量
+                for i, target_path, _ in ready:
+                    self._rollback_file(target_path)
+                    results[i] = f"❌ {os.path.basename(file_paths[i])}: {str(e)}"
+                self._rollback_vectors(kb_name, [os.path.basename(path) for _, path, _ in ready])
+                return results, 0
+
+            finally:
+                # ✅ 让缓存失效，以便下次查询时包含新文件
+                invalidate_bm25_cache(kb_name)
+                invalidate_index_cache(kb_name)
+
+        log(f"✅ 增量索引完成并保存: {len(ready)} 个文件")
+        return results, len(ready)
+
+    def _prepare_document(
+            self,
+            temp_file_path: str,
+            kb_name: str,
+            batch_size: Optional[int] = None
+    ) -> Tuple[str, Optional[str], Optional[list]]:
+        """
+        拷贝文件到知识库目录，并完成解析、切分和向量化（不写入索引）
+        Returns:
+            Tuple: (结果信息, 目标路径, 已带 embedding 的节点)；失败时后两项为 None
+        """
+        target_path = None
         try:
             if not os.path.exists(temp_file_path):
-                return "❌ 文件不存在"
+                return "❌ 文件不存在", None, None
 
             filename = os.path.basename(temp_file_path)
             _, ext = os.path.splitext(filename)
 
             if ext.lower() not in self.SUPPORTED_FORMATS:
-                return f"❌ 不支持的文件格式: {ext}"
+                return f"❌ 不支持的文件格式: {ext}", None, None
 
             # 1. 移动文件到知识库目录
             target_dir = get_kb_path(kb_name)
             os.makedirs(target_dir, exist_ok=True)
-            target_path = os.path.join(target_dir, filename)
-
-            if os.path.exists(target_path):
-                base, ext = os.path.splitext(filename)
-                filename = f"{base}_{int(time.time())}{ext}"
-                target_path = os.path.join(target_dir, filename)
-                log(f"文件名冲突，重命名为: {filename}")
-
-            shutil.copy2(temp_file_path, target_path)
-
-            # 2. 获取当前索引
-            index = self.get_index(kb_name)
+            target_path = self._reserve_target_path(target_dir, filename)
+            filename = os.path.basename(target_path)
+            try:
+                shutil.copy2(temp_file_path, target_path)
+            finally:
+                # 拷贝完成后文件本身即可防止重名，释放内存中的占位
+                self._release_target_path(target_path)
 
-            # 3. 增量更新
+            # 2. 解析与切分
             log(f"正在增量索引: {filename}")
             new_docs = SimpleDirectoryReader(input_files=[target_path]).load_data()
 
+            # 记录文件内容哈希，用于后续上传去重（不参与向量化和 LLM 上下文）
+            file_hash = self.file_sha256(target_path)
+            for doc in new_docs:
+                doc.metadata["file_hash"] = file_hash
+                doc.excluded_embed_metadata_keys.append("file_hash")
+                doc.excluded_llm_metadata_keys.append("file_hash")
+
             # 此时 Settings.node_parser 已经是我们在 model_factory 里配置好的了
             nodes = Settings.node_parser.get_nodes_from_documents(new_docs)
-            index.insert_nodes(nodes)
 
-            # ✅ 持久化到指定目录 (DocStore)
-            kb_persist_dir = os.path.join(STORAGE_DIR, f"docstore_{kb_name}")
-            os.makedirs(kb_persist_dir, exist_ok=True)
-            index.storage_context.persist(persist_dir=kb_persist_dir)
+            # 3. 提前向量化，insert_nodes 会跳过已有 embedding 的节点
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            step = batch_size or len(texts) or 1
+            embeddings = []
+            for start in range(0, len(texts), step):
+                embeddings.extend(Settings.embed_model.get_text_embedding_batch(texts[start:start + step]))
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
 
-            # ✅ 让 BM25 缓存失效，以便下次查询时包含新文件
-            invalidate_bm25_cache(kb_name)
-            invalidate_index_cache(kb_name)
-
-            log(f"✅ 增量索引完成并保存: {filename}")
-            return f"✅ 索引成功: {filename}"
+            return f"✅ 索引成功: {filename}", target_path, nodes
 
         except Exception as e:
-            error(f"❌ 上传文档处理失败: {e}")
-
+            error(f"上传文件失败 {temp_file_path}: {e}")
             # 如果文件已经拷贝过去了，但索引失败，必须删掉它！
-            if target_path and os.path.exists(target_path):
-                try:
-                    os.remove(target_path)
-                    log(f"⚠️ 已执行回滚：删除了未成功索引的文件 {target_path}")
-                except Exception as cleanup_err:
-                    error(f"❌ 回滚删除文件失败: {cleanup_err}")
+            self._rollback_file(target_path)
+            return f"❌ {os.path.basename(temp_file_path)}: {str(e)}", None, None
 
-            # 重新抛出异常，让上层知道失败了
-            raise e
+    def _reserve_target_path(self, target_dir: str, filename: str) -> str:
+        """
+        选定不冲突的目标路径并在内存中占位，防止并发上传同名文件互相覆盖
+        不在磁盘上创建占位文件，避免索引期间文件列表中出现空文件
+        """
+        with self._name_lock:
+            def taken(path: str) -> bool:
+                return path in self._reserved_paths or os.path.exists(path)
+
+            target_path = os.path.join(target_dir, filename)
+            if taken(target_path):
+                base, ext = os.path.splitext(filename)
+                suffix = int(time.time())
+                target_path = os.path.join(target_dir, f"{base}_{suffix}{ext}")
+                while taken(target_path):
+                    suffix += 1
+                    target_path = os.path.join(target_dir, f"{base}_{suffix}{ext}")
+                log(f"文件名冲突，重命名为: {os.path.basename(target_path)}")
+
+            self._reserved_paths.add(target_path)
+            return target_path
+
+    def _release_target_path(self, target_path: str):
+        with self._name_lock:
+            self._reserved_paths.discard(target_path)
+
+    @staticmethod
+    def _rollback_vectors(kb_name: str, filenames: List[str]):
+        """删除插入失败时可能残留在 Chroma 中的向量（按 file_name），避免被上传去重误判为已存在"""
+        if not filenames:
+            return
+        try:
+            collection = resource_manager.chroma_client.get_collection(f"kb_{kb_name}")
+            collection.delete(where={"file_name": {"$in": filenames}})
+            log(f"⚠️ 已执行回滚：清理了 {len(filenames)} 个文件的残留向量")
+        except Exception as cleanup_err:
+            error(f"❌ 回滚清理向量失败: {cleanup_err}")
+
+    @staticmethod
+    def _rollback_file(target_path: Optional[str]):
+        if target_path and os.path.exists(target_path):
+            try:
+                os.remove(target_path)
+                log(f"⚠️ 已执行回滚：删除了未成功索引的文件 {target_path}")
+            except Exception as cleanup_err:
+                error(f"❌ 回滚删除文件失败: {cleanup_err}")
 
     def create_kb(self, name: str) -> Tuple[bool, str]:
         try:
@@ -177,6 +336,7 @@ class RAGPipeline:
 
             os.makedirs(path, exist_ok=True)
             # 初始化一个空索引
+            self.ensure_models()
             get_or_build_index(name, resource_manager.chroma_client, use_cache=False)
             return True, f"✅ 知识库 '{name}' 创建成功"
         except Exception as e:
@@ -184,6 +344,37 @@ class RAGPipeline:
 
     def delete_document(self, filename: str, kb_name: str) -> str:
         """删除文档"""
+        return self.delete_documents([filename], kb_name)[0]
+
+    def delete_documents(self, filenames: List[str], kb_name: str) -> List[str]:
+        """
+        批量删除文档
+        向量清理是 I/O 密集型操作，使用线程池并发执行，缓存只在最后失效一次
+        Returns:
+            List[str]: 与 filenames 一一对应的结果信息
+        """
+        if not filenames:
+            return []
+
+        try:
+            index = self.get_index(kb_name)
+        except Exception as e:
+            error(f"删除文档失败: {e}")
+            return [f"❌ 删除失败: {str(e)}"] * len(filenames)
+
+        workers = min(self.MAX_DELETE_WORKERS, len(filenames))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda f: self._delete_single_document(f, kb_name, index),
+                filenames
+            ))
+
+        invalidate_index_cache(kb_name)
+        invalidate_bm25_cache(kb_name)
+        return results
+
+    def _delete_single_document(self, filename: str, kb_name: str, index) -> str:
+        """删除单个文档的物理文件与向量（不处理缓存）"""
         if not filename or not filename.strip():
             return "❌ 文件名不能为空"
 
@@ -194,10 +385,7 @@ class RAGPipeline:
                 os.remove(path)
                 log(f"🗑已删除文件: {filename}")
 
-            # 2. 获取索引
-            index = self.get_index(kb_name)
-
-            # 首先需要找到该文件对应的所有 ref_doc_id
+            # 2. 首先需要找到该文件对应的所有 ref_doc_id
             try:
                 vector_store = index._vector_store
                 if isinstance(vector_store, ChromaVectorStore):
@@ -230,8 +418,6 @@ class RAGPipeline:
 
             except Exception as e:
                 error(f"向量清理失败: {e}")
-            invalidate_index_cache(kb_name)
-            invalidate_bm25_cache(kb_name)
             return f"✅ 已删除: {filename}"
 
         except Exception as e:
@@ -249,6 +435,56 @@ class RAGPipeline:
         except:
             return []
 
+    @staticmethod
+    def file_sha256(path: str) -> str:
+        """分块计算文件的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def list_hashes(self, kb_name: str, candidates: Optional[Iterable[str]] = None) -> Set[str]:
+        """
+        读取知识库中已索引文件的内容哈希（只查 Chroma 元数据，不加载索引和模型）
+        只统计磁盘上仍存在的文件：删除时向量清理失败等情况留下的残留向量不算，否则该文件再也无法重新上传
+        Args:
+            candidates: 只检查这些哈希是否已存在；为 None 时返回全部
+        """
+        try:
+            collection = resource_manager.chroma_client.get_collection(f"kb_{kb_name}")
+        except Exception:
+            return set()
+
+        try:
+            if candidates is None:
+                where = {"file_hash": {"$ne": ""}}
+            else:
+                candidates = list(candidates)
+                if not candidates:
+                    return set()
+                where = {"file_hash": {"$in": candidates}}
+            results = collection.get(where=where, include=["metadatas"])
+            existing_files = set(self.list_files(kb_name))
+            return {
+                m["file_hash"] for m in results.get("metadatas") or []
+                if m and m.get("file_hash") and m.get("file_name") in existing_files
+            }
+        except Exception as e:
+            warn(f"读取文件哈希失败 {kb_name}: {e}")
+            return set()
+
+    def count_files(self, kb_name: str) -> int:
+        """统计知识库文件数（只遍历目录项，不排序、不构建文件名列表）"""
+        try:
+            if not kb_name: return 0
+            kb_path = get_kb_path(kb_name)
+            if not os.path.exists(kb_path): return 0
+            with os.scandir(kb_path) as it:
+                return sum(1 for entry in it if entry.is_file())
+        except:
+            return 0
+
     def delete_knowledge_base(self, kb_name: str) -> Tuple[bool, str]:
         # (保持原有逻辑，增加缓存清理)
         if kb_name == DEFAULT_KB_NAME: return False, "不可删除默认库"
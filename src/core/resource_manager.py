@@ -54,6 +54,7 @@ class ResourceManager:
             self._health_status = {
                 "chroma": False,
                 "models": False,
+                "models_load_failed": False,  # 模型按需加载：区分“尚未加载”和“加载失败”
                 "last_check": None
             }
             self._is_shutdown = False   # ✅ 新增：标记是否已关闭
@@ -131,15 +132,23 @@ class ResourceManager:
                 init_global_models()
                 self._models_initialized = True
                 self._health_status["models"] = True
+                self._health_status["models_load_failed"] = False
                 log("✅ 模型初始化成功")
                 return True
 
             except Exception as e:
                 error(f"❌ 模型初始化失败: {e}")
                 self._health_status["models"] = False
+                self._health_status["models_load_failed"] = True
                 traceback.print_exc()
                 return False
 
+    def ensure_models(self) -> bool:
+        """按需初始化模型（首次查询/索引时调用，已初始化时直接返回）"""
+        if self._models_initialized:
+            return True
+        return self._initialize_models()
+
     def _initialize_chroma(self, force: bool = False) -> bool:
         """初始化 ChromaDB 客户端"""
         with self._chroma_lock:
@@ -204,6 +213,10 @@ class ResourceManager:
     @property
     def chroma_client(self) -> chromadb.PersistentClient:
         """获取 ChromaDB 客户端（带自动重连）"""
+        return self.ensure_chroma()
+
+    def ensure_chroma(self) -> chromadb.PersistentClient:
+        """确保 ChromaDB 已连接（不可用时自动重连），失败时抛出 RuntimeError"""
         if self._is_shutdown:
             raise RuntimeError("资源管理器已关闭，无法访问 ChromaDB 客户端")
 
@@ -281,6 +294,7 @@ class ResourceManager:
         """获取当前状态（不执行检查）"""
         return {
             "models_initialized": self._models_initialized,
+            "models_load_failed": self._health_status["models_load_failed"],
             "chroma_connected": self._chroma_client is not None,
             "is_shutdown": self._is_shutdown,
             "health_status": self._health_status.copy(),
@@ -0,0 +1,183 @@
+# src/core/response_cache.py
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from src.core.logger import log
+
+
+class ResponseCache:
+    """
+    问答结果缓存
+
+    特性:
+    - 精确匹配: (知识库, 规范化问题, 历史指纹, 知识库版本) 作为键
+    - 语义匹配: 精确未命中时，比较问题向量的余弦相似度，超过阈值则复用回答
+    - LRU + TTL 淘汰，并按总字节数限制容量
+    - 知识库更新后调用 invalidate_kb 使旧结果失效
+    - 线程安全
+    """
+
+    def __init__(
+            self,
+            ttl: int = 3600,
+            max_bytes: int = 100 * 1024 * 1024,
+            similarity_threshold: float = 0.95
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+
+        self._lock = threading.RLock()
+        # key -> (response, 写入时间, 问题向量, 占用字节)
+        self._entries: "OrderedDict[tuple, Tuple[str, float, Optional[np.ndarray], int]]" = OrderedDict()
+        self._kb_versions: Dict[str, int] = {}
+        self._total_bytes = 0
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return re.sub(r"\s+", " ", query.strip().lower())
+
+    @staticmethod
+    def _history_fingerprint(history: Sequence[Tuple[str, str]]) -> str:
+        """最近 5 轮历史的指纹，避免依赖上下文的追问命中错误的缓存"""
+        raw = "\x1f".join(f"{q}\x1e{a}" for q, a in list(history)[-5:])
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def _make_key(
+            self,
+            kb_name: str,
+            query: str,
+            history: Sequence[Tuple[str, str]],
+            version: Optional[int] = None
+    ) -> tuple:
+        return (
+            kb_name,
+            self._normalize(query),
+            self._history_fingerprint(history),
+            self._kb_versions.get(kb_name, 0) if version is None else version
+        )
+
+    def kb_version(self, kb_name: str) -> int:
+        """知识库当前版本号：查询开始前读取，写入缓存时传给 put()"""
+        with self._lock:
+            return self._kb_versions.get(kb_name, 0)
+
+    def _is_expired(self, ts: float) -> bool:
+        return time.monotonic() - ts > self.ttl
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[3]
+
+    def get(
+            self,
+            kb_name: str,
+            query: str,
+            history: Sequence[Tuple[str, str]],
+            query_embedding: Optional[List[float]] = None
+    ) -> Optional[str]:
+        """
+        查询缓存
+        Args:
+            query_embedding: 问题向量，提供时在精确未命中后进行语义匹配
+        Returns: 缓存的回答或 None
+        """
+        with self._lock:
+            key = self._make_key(kb_name, query, history)
+
+            # 1. 精确匹配
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_expired(entry[1]):
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    log(f"⚡ 问答缓存命中(精确): {query[:30]}...")
+                    return entry[0]
+
+            if query_embedding is None:
+                return None
+
+            # 2. 语义匹配（只在同一知识库、同一版本、同一历史下比较）
+            candidates = []
+            vectors = []
+            for cached_key, (_, ts, vec, _) in list(self._entries.items()):
+                if vec is None or cached_key[0] != key[0] or cached_key[2:] != key[2:]:
+                    continue
+                if self._is_expired(ts):
+                    self._remove(cached_key)
+                    continue
+                candidates.append(cached_key)
+                vectors.append(vec)
+
+            if not candidates:
+                return None
+
+            query_vec = self._unit(query_embedding)
+            scores = np.stack(vectors) @ query_vec
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+
+            best_key = candidates[best]
+            self._entries.move_to_end(best_key)
+            log(f"⚡ 问答缓存命中(语义 {scores[best]:.3f}): {query[:30]}...")
+            return self._entries[best_key][0]
+
+    def put(
+            self,
+            kb_name: str,
+            query: str,
+            history: Sequence[Tuple[str, str]],
+            response: str,
+            query_embedding: Optional[List[float]] = None,
+            version: Optional[int] = None
+    ):
+        """
+        写入缓存
+        Args:
+            version: 查询开始时的 kb_version()；生成期间知识库被修改（版本变化）则丢弃，
+                     避免基于旧索引的回答被存到新版本下
+        """
+        vec = self._unit(query_embedding) if query_embedding is not None else None
+        size = sys.getsizeof(response) + (vec.nbytes if vec is not None else 0)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if version is not None and version != self._kb_versions.get(kb_name, 0):
+                log(f"知识库 {kb_name} 在生成期间已更新，丢弃旧回答缓存")
+                return
+            key = self._make_key(kb_name, query, history, version)
+            self._remove(key)
+            self._entries[key] = (response, time.monotonic(), vec, size)
+            self._total_bytes += size
+
+            # 超出容量时按 LRU 淘汰
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate_kb(self, kb_name: str):
+        """知识库内容变化后调用：提升版本号并清除该库的缓存"""
+        with self._lock:
+            self._kb_versions[kb_name] = self._kb_versions.get(kb_name, 0) + 1
+            for key in [k for k in self._entries if k[0] == kb_name]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @staticmethod
+    def _unit(vec: List[float]) -> np.ndarray:
+        arr = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        return arr / norm if norm > 0 else arr
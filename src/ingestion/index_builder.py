@@ -1,56 +1,61 @@
 # src/ingestion/index_builder.py
 import os
 import threading
-from typing import Optional, Dict
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core.storage.docstore import SimpleDocumentStore
-from llama_index.core.storage.index_store import SimpleIndexStore
-from llama_index.core.schema import TextNode, Document
+from typing import Optional, Dict, TYPE_CHECKING
 from src.core.logger import log, error, warn
 from config.settings import STORAGE_DIR
 
+# llama_index 导入链很重，只用于类型标注；实际导入推迟到函数内部，加快冷启动
+if TYPE_CHECKING:
+    from llama_index.core import VectorStoreIndex
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
 
 class _IndexCache:
     def __init__(self):
-        self._cache: Dict[str, VectorStoreIndex] = {}
+        self._cache: Dict[str, "VectorStoreIndex"] = {}
         self._lock = threading.RLock()
 
-    def get(self, kb_name: str) -> Optional[VectorStoreIndex]:
+    def get(self, kb_name: str) -> Optional["VectorStoreIndex"]:
         with self._lock:
             return self._cache.get(kb_name)
 
-    def set(self, kb_name: str, index: VectorStoreIndex):
+    def set(self, kb_name: str, index: "VectorStoreIndex"):
         with self._lock:
             self._cache[kb_name] = index
 
     def invalidate(self, kb_name: str):
         with self._lock:
-            if kb_name in self._cache:
-                del self._cache[kb_name]
+            self._cache.pop(kb_name, None)
 
 
 _index_cache = _IndexCache()
 
 
-def get_or_build_index(kb_name: str, chroma_client, use_cache: bool = True) -> VectorStoreIndex:
+def get_or_build_index(kb_name: str, chroma_client, use_cache: bool = True) -> "VectorStoreIndex":
     # 1. 缓存层
     if use_cache:
         cached_index = _index_cache.get(kb_name)
         if cached_index is not None:
             return cached_index
 
+    from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+    from llama_index.core.storage.index_store import SimpleIndexStore
+
     try:
         coll_name = f"kb_{kb_name}"
         collection = chroma_client.get_or_create_collection(coll_name)
+        # 向量数只查询一次，后续的 DocStore 校验复用
+        vector_count = collection.count()
+
         vector_store = ChromaVectorStore(chroma_collection=collection)
 
         # 持久化目录
         kb_persist_dir = os.path.join(STORAGE_DIR, f"docstore_{kb_name}")
         os.makedirs(kb_persist_dir, exist_ok=True)
 
-        vector_count = collection.count()
-
         # 尝试从磁盘恢复 StorageContext
         try:
             storage_context = StorageContext.from_defaults(
@@ -63,7 +68,7 @@ def get_or_build_index(kb_name: str, chroma_client, use_cache: bool = True) -> V
                 index = load_index_from_storage(storage_context, vector_store=vector_store)
 
                 # ✅ 验证 DocStore 完整性
-                if _validate_docstore(index, collection):
+                if _validate_docstore(index, collection, vector_count):
                     log(f"✅ DocStore 验证通过: {kb_name}")
                 else:
                     # DocStore 不完整，需要重建
@@ -92,7 +97,7 @@ def get_or_build_index(kb_name: str, chroma_client, use_cache: bool = True) -> V
                 index = VectorStoreIndex.from_documents([], storage_context=storage_context)
                 index.storage_context.persist(persist_dir=kb_persist_dir)
 
-        # 3. 缓存
+        # 3. 缓存索引
         if use_cache:
             _index_cache.set(kb_name, index)
         return index
@@ -102,22 +107,18 @@ def get_or_build_index(kb_name: str, chroma_client, use_cache: bool = True) -> V
         raise
 
 
-def _validate_docstore(index: VectorStoreIndex, collection) -> bool:
-    """验证 DocStore 是否完整"""
+def _validate_docstore(index: "VectorStoreIndex", collection, chroma_count: int) -> bool:
+    """验证 DocStore 是否完整（chroma_count 由调用方传入，避免重复 count 调用）"""
     try:
         docstore = index.docstore
-        chroma_count = collection.count()
 
         # 获取几个 ID 测试
         results = collection.get(limit=min(10, chroma_count), include=["metadatas"])
         test_ids = results.get("ids", [])
 
-        missing_count = 0
-        for node_id in test_ids:
-            try:
-                docstore.get_node(node_id)
-            except:
-                missing_count += 1
+        # document_exists 只做一次 KV 查找，不反序列化节点也不抛异常
+        # （docstore.docs 属性会反序列化整个 DocStore，不适合做存在性检查）
+        missing_count = sum(1 for node_id in test_ids if not docstore.document_exists(node_id))
 
         if missing_count > 0:
             warn(f"DocStore 缺失率过高: {missing_count}/{len(test_ids)}")
@@ -131,18 +132,23 @@ def _validate_docstore(index: VectorStoreIndex, collection) -> bool:
 
 
 def _rebuild_docstore_from_chroma(
-        vector_store: ChromaVectorStore,
+        vector_store: "ChromaVectorStore",
         kb_persist_dir: str,
         collection
-) -> VectorStoreIndex:
+) -> "VectorStoreIndex":
     """
     从 ChromaDB 重建 DocStore
     正确创建 TextNode，不直接设置 ref_doc_id
     """
+    from llama_index.core import VectorStoreIndex, StorageContext
+    from llama_index.core.storage.index_store import SimpleIndexStore
+    from llama_index.core.schema import TextNode, Document, NodeRelationship, RelatedNodeInfo
+    from src.ingestion.orjson_docstore import OrjsonDocumentStore
+
     log("从 ChromaDB 重建 DocStore...")
 
-    # 创建新的存储组件
-    docstore = SimpleDocumentStore()
+    # 创建新的存储组件（orjson 持久化，大库重建时写盘更快）
+    docstore = OrjsonDocumentStore()
     index_store = SimpleIndexStore()
 
     storage_context = StorageContext.from_defaults(
@@ -159,6 +165,8 @@ def _rebuild_docstore_from_chroma(
         log(f"从 ChromaDB 获取到 {node_count} 个节点")
 
         success_count = 0
+        docs_buf = []
+        seen_doc_ids = set()
 
         # ✅ 关键修复：正确创建节点
         for idx, node_id in enumerate(results["ids"]):
@@ -166,52 +174,44 @@ def _rebuild_docstore_from_chroma(
                 text = results["documents"][idx]
                 metadata = results["metadatas"][idx]
 
-                # 方案1: 如果有 doc_id，创建 Document
                 doc_id = metadata.get("doc_id") or metadata.get("ref_doc_id")
 
-                if doc_id:
-                    # 创建 Document（会自动设置 doc_id）
-                    doc = Document(
-                        text=text,
-                        id_=doc_id,
-                        metadata=metadata,
-                        excluded_embed_metadata_keys=["file_name", "file_path"],
-                        excluded_llm_metadata_keys=["file_name", "file_path"]
-                    )
-                    docstore.add_documents([doc])
-
-                    # 再创建对应的 TextNode
-                    node = TextNode(
-                        text=text,
-                        id_=node_id,
-                        metadata=metadata,
-                        excluded_embed_metadata_keys=["file_name", "file_path"],
-                        excluded_llm_metadata_keys=["file_name", "file_path"]
-                    )
+                node = TextNode(
+                    text=text,
+                    id_=node_id,
+                    metadata=metadata,
+                    excluded_embed_metadata_keys=["file_name", "file_path"],
+                    excluded_llm_metadata_keys=["file_name", "file_path"]
+                )
+
+                # 只有 doc_id 与 node_id 不同时才需要独立的 Document，
+                # 单块文档（doc_id == node_id）或无 doc_id 时只保存 TextNode
+                if doc_id and doc_id != node_id:
+                    if doc_id not in seen_doc_ids:
+                        seen_doc_ids.add(doc_id)
+                        docs_buf.append(Document(
+                            text=text,
+                            id_=doc_id,
+                            metadata=metadata,
+                            excluded_embed_metadata_keys=["file_name", "file_path"],
+                            excluded_llm_metadata_keys=["file_name", "file_path"]
+                        ))
                     # ✅ 通过 relationships 关联 Document
-                    from llama_index.core.schema import NodeRelationship, RelatedNodeInfo
                     node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(
                         node_id=doc_id,
                         metadata={}
                     )
-                    docstore.add_documents([node])
-                else:
-                    # 如果没有 doc_id，直接创建独立 TextNode
-                    node = TextNode(
-                        text=text,
-                        id_=node_id,
-                        metadata=metadata,
-                        excluded_embed_metadata_keys=["file_name", "file_path"],
-                        excluded_llm_metadata_keys=["file_name", "file_path"]
-                    )
-                    docstore.add_documents([node])
 
+                docs_buf.append(node)
                 success_count += 1
 
             except Exception as e:
                 warn(f"重建节点失败 {node_id}: {e}")
                 continue
 
+        # 批量写入 DocStore
+        docstore.add_documents(docs_buf)
+
         log(f"✅ DocStore 重建完成,成功 {success_count}/{node_count} 个节点")
 
         # 验证重建结果
@@ -248,5 +248,5 @@ def _rebuild_docstore_from_chroma(
 
 
 def invalidate_index_cache(kb_name: str):
-    """清除索引缓存"""
+    """清除索引缓存，所有写路径都应调用"""
     _index_cache.invalidate(kb_name)
\ No newline at end of file
@@ -0,0 +1,21 @@
+# src/ingestion/orjson_docstore.py
+import os
+import orjson
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+
+class OrjsonDocumentStore(SimpleDocumentStore):
+    """
+    使用 orjson 持久化的 DocStore
+    输出仍是标准 UTF-8 JSON，可被 SimpleDocumentStore.from_persist_dir 直接加载
+    """
+
+    def persist(self, persist_path: str, fs=None) -> None:
+        # 非本地文件系统走原有逻辑
+        if fs is not None:
+            super().persist(persist_path, fs=fs)
+            return
+
+        os.makedirs(os.path.dirname(persist_path), exist_ok=True)
+        with open(persist_path, "wb") as f:
+            f.write(orjson.dumps(self.to_dict(), option=orjson.OPT_NON_STR_KEYS))
@@ -1,11 +1,43 @@
 # src/streamlit_app.py
+import hashlib
 import os
+import shutil
 import tempfile
+import threading
+import pandas as pd
 import streamlit as st
 import time
-from src.core.rag_pipeline import RAGPipeline
-from src.core.resource_manager import resource_manager
-from config.settings import DEFAULT_KB_NAME
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+# 注意：llama_index / ChromaDB 相关模块较重，在函数内按需导入，页面配置与样式可以先渲染
+from src.core.response_cache import ResponseCache
+from src.core.logger import warn
+from config.settings import (
+    DEFAULT_KB_NAME,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_MB,
+    RESPONSE_CACHE_SIMILARITY
+)
+
+# 上传时并发写入/清理临时文件的线程数
+UPLOAD_IO_WORKERS = 8
+# 只有 tmpfs 剩余空间不少于本批上传总大小的这么多倍时才使用内存文件系统（Docker 默认 /dev/shm 仅 64MB）
+TMPFS_HEADROOM = 2
+# 上传索引时每个文件向量化的切片大小（文本块数，每次请求的块数由模型 embed_batch_size 决定）
+UPLOAD_EMBED_BATCH_SIZE = 32
+# 知识库管理页每页显示的文件数
+FILES_PAGE_SIZE = 50
+# 传给问答的最近对话轮数（问题 + 回答）
+HISTORY_WINDOW = 5
+# 对话区默认只渲染最近的消息数，每次“加载更早消息”再增加同样数量
+VISIBLE_WINDOW_STEP = 20
+# 流式输出时刷新回答占位符的最小间隔（秒）
+STREAM_FLUSH_INTERVAL = 0.05
+# 模型没有返回任何内容时显示的提示
+EMPTY_REPLY = "⚠️ 未生成任何回答，请重试。"
+# 会话中最多保留的消息数，超出后从最早的开始丢弃
+MAX_MESSAGES = 1000
 
 # ==================== 页面配置 ====================
 st.set_page_config(
@@ -16,152 +48,188 @@ st.set_page_config(
 )
 
 # ==================== CSS 样式配置 ====================
-st.markdown("""
-<style>
-    /* ========== 1. 全局与容器调整 ========== */
-    .block-container {
-        padding-top: 2rem !important;
-        padding-bottom: 1rem !important;
-    }
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-
-    /* ========== 2. 侧边栏样式========== */
-    section[data-testid="stSidebar"] p, 
-    section[data-testid="stSidebar"] span {
-        font-size: 16px !important;
-        line-height: 1.8 !important;
-    }
-    section[data-testid="stSidebar"] h1,
-    section[data-testid="stSidebar"] h2,
-    section[data-testid="stSidebar"] h3 {
-        font-size: 20px !important;
-        padding-top: 5px !important;
-        padding-bottom: 30px !important;
-    }
-    section[data-testid="stSidebar"] hr {
-        margin-top: 1rem !important;
-        margin-bottom: 1rem !important;
-    }
-
-    /* ========== 3. 状态指示灯 ========== */
-    .status-indicator {
-        display: inline-block;
-        width: 10px;
-        height: 10px;
-        border-radius: 50%;
-        margin-right: 5px;
-    }
-    .status-error { background-color: #4caf50; }
-    .status-ok { background-color: #f44336; }
-
-    /* ========== 4. 聊天界面样式  ========== */
-    /* 助手消息 (原生 st.chat_message) */
-    /* 给助手气泡加一个浅灰背景，使其更像气泡 */
-    [data-testid="stChatMessageContent"] {
-        background-color: #f0f2f6;
-        border-radius: 10px;
-        padding: 10px 15px;
-        border-top-left-radius: 0; /* 左上角尖角 */
-        margin-right: 40%; /* 限制最大宽度 */
-        font-size: 20px !important;
-        margin-top: 20px !important;
-    }
-
-    /* 容器：顶部对齐 */
-    .user-chat-container {
-        display: flex;
-        justify-content: flex-end;
-        align-items: flex-start; /* 顶部对齐 */
-        margin-bottom: 20px;
-    }
-
-     /* 用户头像 */
-    .user-avatar {
-        width: 30px;
-        height: 30px;
-        font-size: 32px;
-        margin-left: 3px;
-        margin-right: 15px; 
-        /* 头像自然对齐顶部 */
-        display: flex;
-        align-items: flex-start; 
-        padding-top: 0px;
-    }
-
-    /* 用户气泡 */
-    .user-bubble {
-        background-color: transparent; 
-        border: 1px solid #e0e0e0;
-        color: inherit;
-        padding: 8px 12px;
-        border-radius: 12px;
-        /* 🔥 关键还原：右上角尖角 (符合图片) */
-        border-top-right-radius: 0; 
-        max-width: 80%;
-        text-align: left;
-        word-wrap: break-word;
-        box-shadow: 0 1px 1px rgba(0,0,0,0.03);
-        font-size: 20px !important;
-        /* 🔥 关键微调：气泡下沉 12px，对齐头像的眼睛/面部，而不是头顶 */
-        margin-top: 30px; 
-    }
-    /* ========== [新增] AI 助手头像大小调节 ========== */
-    /* 1. 放大头像容器，并设置最小宽度防止被Flex挤压 */
-    [data-testid="stChatMessage"] [data-testid="stChatMessageAvatar"] {
-        width: 60px !important;
-        height: 60px !important;
-        min-width: 60px !important; /* 关键：防止 flex 布局压缩 */
-        margin-right: 15px !important; /* 增加头像和气泡的间距 */
-    }
-
-    /* 2. 放大头像内部的 Emoji 字体和居中容器 */
-    [data-testid="stChatMessage"] [data-testid="stChatMessageAvatar"] > div {
-        width: 60px !important;
-        height: 60px !important;
-        line-height: 60px !important;
-        font-size: 40px !important; /* Emoji 字体大小 */
-        display: flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-        border-radius: 50% !important; /* 保持圆形 */
-    }
-</style>
-""", unsafe_allow_html=True)
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "styles.css")
+
+
+@st.cache_resource
+def get_css() -> str:
+    """读取页面样式（每个进程只读取一次文件）"""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+
+# st.html 对纯样式内容不占用页面布局；样式必须每次整页运行都输出，否则会被前端移除
+st.html(get_css())
 
 
 # ==================== 初始化逻辑 ====================
 @st.cache_resource
 def init_pipeline():
     """初始化 RAG Pipeline"""
+    from src.core.rag_pipeline import RAGPipeline
+
     try:
         pipeline = RAGPipeline()
-        pipeline.create_kb(DEFAULT_KB_NAME)
+        # 默认库已存在时跳过，避免冷启动就加载模型
+        if DEFAULT_KB_NAME not in pipeline.list_knowledge_bases():
+            pipeline.create_kb(DEFAULT_KB_NAME)
         return pipeline, None
     except Exception as e:
         return None, str(e)
 
 
-def init_session_state():
-    """初始化会话状态"""
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    if "current_kb" not in st.session_state:
-        st.session_state.current_kb = DEFAULT_KB_NAME
-    if "kb_list" not in st.session_state:
-        st.session_state.kb_list = []
-    if "show_create_kb" not in st.session_state:
-        st.session_state.show_create_kb = False
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """问答缓存（进程内所有会话共享）"""
+    return ResponseCache(
+        ttl=RESPONSE_CACHE_TTL,
+        max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        similarity_threshold=RESPONSE_CACHE_SIMILARITY
+    )
 
-    if "confirm_delete_file" not in st.session_state:
-        st.session_state.confirm_delete_file = None
-    if "confirm_delete_kb" not in st.session_state:
-        st.session_state.confirm_delete_kb = None
 
-    if "toast_msg" not in st.session_state:
-        st.session_state.toast_msg = None
-    if "error_msg" not in st.session_state:
-        st.session_state.error_msg = None
+@st.cache_resource
+def get_upload_executor() -> ThreadPoolExecutor:
+    """后台索引线程池（进程内所有会话共享），避免上传阻塞脚本线程"""
+    return ThreadPoolExecutor(max_workers=2)
+
+
+class CacheVersions:
+    """
+    进程级缓存版本号（所有会话共享）
+    st.cache_data 的缓存在会话间共享，版本号也必须进程唯一，否则不同会话各自递增会撞上同一个缓存键
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get(self, key) -> int:
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+
+# 知识库列表在 CacheVersions 中的键（知识库名均为字符串，不会冲突）
+KB_LIST_VERSION_KEY = None
+
+
+@st.cache_resource
+def get_cache_versions() -> CacheVersions:
+    return CacheVersions()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_list_files(_pipeline, kb_name: str, version: int) -> List[str]:
+    """
+    缓存知识库文件列表
+    version 为该知识库在 get_cache_versions() 中的进程级版本号，任一会话修改库内容时递增使缓存失效；
+    TTL 兜底绕过界面的修改（如直接改动磁盘目录）
+    """
+    return _pipeline.list_files(kb_name)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_count_files(_pipeline, kb_name: str, version: int) -> int:
+    """缓存知识库文件数（version 含义同 cached_list_files）"""
+    return _pipeline.count_files(kb_name)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_list_kbs(_pipeline, version: int) -> List[str]:
+    """缓存知识库列表（version 为 get_cache_versions() 中的进程级列表版本，新建/删除库时递增）"""
+    return _pipeline.list_knowledge_bases()
+
+
+def is_failed_reply(response: str) -> bool:
+    """错误/空回答（回答部分为空、只有来源引用也算）：不写入问答缓存，也不作为对话历史发回 LLM"""
+    from src.core.custom_rag_chat import ERROR_REPLY
+    return (
+        response.startswith(("❌", "⚠️"))
+        or ERROR_REPLY in response
+        or not split_assistant(response)[0].strip()
+    )
+
+
+def cached_query_stream(pipeline, query: str, kb_name: str, history) -> Iterator[str]:
+    """带缓存的流式查询：精确命中 -> 语义命中 -> 调用 pipeline 流式生成"""
+    from llama_index.core import Settings
+
+    cache = get_response_cache()
+    # 在检索之前记录版本：生成期间如有上传/删除，回答不会被缓存到新版本下
+    version = cache.kb_version(kb_name)
+    cached = cache.get(kb_name, query, history)
+    if cached is not None:
+        yield cached
+        return
+
+    query_embedding = None
+    try:
+        pipeline.ensure_models()
+        query_embedding = Settings.embed_model.get_query_embedding(query)
+    except Exception as e:
+        warn(f"问答缓存计算问题向量失败，跳过语义匹配: {e}")
+
+    if query_embedding is not None:
+        cached = cache.get(kb_name, query, history, query_embedding)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    for chunk in pipeline.query_stream(query, kb_name, history):
+        parts.append(chunk)
+        yield chunk
+    response = "".join(parts)
+
+    # 不缓存错误信息
+    if not is_failed_reply(response):
+        cache.put(kb_name, query, history, response, query_embedding, version=version)
+
+
+def split_answer_stream(chunks: Iterable[str], parts: List[str]) -> Iterator[str]:
+    """
+    将完整回复收集到 parts，只向界面输出回答部分
+    来源引用（SOURCES_SEPARATOR 之后）留到流结束后放进“参考来源”折叠框
+    """
+    from src.core.custom_rag_chat import SOURCES_SEPARATOR
+
+    in_sources = False
+    for chunk in chunks:
+        parts.append(chunk)
+        if in_sources:
+            continue
+        if SOURCES_SEPARATOR in chunk:
+            in_sources = True
+            chunk = chunk.split(SOURCES_SEPARATOR, 1)[0]
+        if chunk:
+            yield chunk
+
+
+# 会话状态默认值：(键, 默认值工厂)，工厂只在键缺失时调用
+_SESSION_DEFAULTS = (
+    ("messages", list),
+    ("chat_history", lambda: deque(maxlen=HISTORY_WINDOW)),
+    ("visible_window", lambda: VISIBLE_WINDOW_STEP),
+    ("current_kb", lambda: DEFAULT_KB_NAME),
+    ("kb_list", list),
+    ("kb_set", frozenset),
+    ("show_create_kb", bool),
+    ("upload_job", lambda: None),
+    ("toast_msg", lambda: None),
+    ("error_msg", lambda: None),
+)
+
+
+def init_session_state():
+    """初始化会话状态"""
+    state = st.session_state
+    for key, factory in _SESSION_DEFAULTS:
+        if key not in state:
+            state[key] = factory()
 
 
 # ==================== 逻辑处理回调函数 ====================
@@ -175,11 +243,13 @@ def create_kb_callback(pipeline):
 
     ok, msg = pipeline.create_kb(name)
     if ok:
-        st.session_state.kb_list = pipeline.list_knowledge_bases()
+        mark_kb_changed(name)
+        mark_kb_list_changed()
         st.session_state.current_kb = name
         st.session_state.kb_selector = name
         st.session_state.show_create_kb = False
         st.session_state.toast_msg = msg
+        request_full_rerun()
     else:
         st.session_state.error_msg = msg
 
@@ -187,15 +257,17 @@ def create_kb_callback(pipeline):
 def delete_kb_confirmed(pipeline, kb_name):
     """执行已确认的知识库删除"""
     pipeline.delete_knowledge_base(kb_name)
+    mark_kb_changed(kb_name)
+    mark_kb_list_changed()
 
     if st.session_state.current_kb == kb_name:
         st.session_state.current_kb = DEFAULT_KB_NAME
         st.session_state.kb_selector = DEFAULT_KB_NAME
         st.session_state.messages = []
+        st.session_state.chat_history.clear()
 
-    st.session_state.kb_list = pipeline.list_knowledge_bases()
-    st.session_state.confirm_delete_kb = None
     st.session_state.toast_msg = f"已删除知识库: {kb_name}"
+    request_full_rerun()
 
 
 def switch_kb_callback(kb_name):
@@ -203,34 +275,124 @@ def switch_kb_callback(kb_name):
     st.session_state.current_kb = kb_name
     st.session_state.kb_selector = kb_name
     st.session_state.messages = []
-    st.session_state.confirm_delete_file = None
-    st.session_state.confirm_delete_kb = None
+    st.session_state.chat_history.clear()
+    request_full_rerun()
 
 
-def refresh_kb_list(pipeline):
-    st.session_state.kb_list = pipeline.list_knowledge_bases()
+def clear_chat_callback():
+    """清空对话回调"""
+    st.session_state.messages = []
+    st.session_state.chat_history.clear()
+    st.session_state.visible_window = VISIBLE_WINDOW_STEP
 
 
-# ==================== 主界面 ====================
-def main():
-    init_session_state()
-    pipeline, error = init_pipeline()
+def load_older_messages_callback():
+    """展开更早的对话消息"""
+    st.session_state.visible_window += VISIBLE_WINDOW_STEP
+
+
+def set_state_callback(key, value):
+    """通用回调：只修改会话状态，由 fragment 自动局部刷新"""
+    st.session_state[key] = value
+
+
+def request_full_rerun():
+    """
+    标记需要整页刷新
+    fragment 内的回调只会触发局部刷新，侧边栏依赖的状态（知识库列表、当前库）变化时需要整页刷新
+    """
+    st.session_state.full_rerun = True
 
-    if error:
-        st.error(f"❌ 系统初始化失败: {error}")
-        st.stop()
 
+def rerun_app_if_requested():
+    """在 fragment 开头调用：如有整页刷新请求则执行"""
+    if st.session_state.pop("full_rerun", False):
+        st.rerun()
+
+
+def show_pending_messages():
+    """显示回调中暂存的提示信息"""
     if st.session_state.toast_msg:
         st.toast(st.session_state.toast_msg)
         st.session_state.toast_msg = None
-        time.sleep(0.5)
 
     if st.session_state.error_msg:
         st.error(st.session_state.error_msg)
         st.session_state.error_msg = None
 
-    if not st.session_state.kb_list:
-        refresh_kb_list(pipeline)
+
+def set_kb_list(kb_list):
+    """更新知识库列表，同时维护用于 O(1) 成员判断的 kb_set"""
+    st.session_state.kb_list = kb_list
+    st.session_state.kb_set = frozenset(kb_list)
+
+
+def kb_version(kb_name: str) -> int:
+    """知识库内容版本号，作为文件列表缓存键的一部分"""
+    return get_cache_versions().get(kb_name)
+
+
+def mark_kb_changed(kb_name):
+    """知识库内容发生变化：使该库的问答缓存和文件列表缓存失效"""
+    get_response_cache().invalidate_kb(kb_name)
+    get_cache_versions().bump(kb_name)
+
+
+def mark_kb_list_changed():
+    """新建/删除知识库后使知识库列表缓存失效（对所有会话生效）"""
+    get_cache_versions().bump(KB_LIST_VERSION_KEY)
+
+
+def sync_kb_list(pipeline):
+    """
+    每次整页运行时从缓存读取知识库列表（新建/删除后版本号变化才会真正重新扫描）
+    列表未变化时保留原对象，避免重建 kb_set
+    """
+    kb_list = cached_list_kbs(pipeline, get_cache_versions().get(KB_LIST_VERSION_KEY))
+    if kb_list != st.session_state.kb_list:
+        set_kb_list(kb_list)
+
+
+# ==================== 主界面 ====================
+@st.cache_data(ttl=5, show_spinner=False)
+def cached_status() -> dict:
+    """资源状态（短 TTL 缓存）"""
+    from src.core.resource_manager import resource_manager
+
+    return resource_manager.get_status()
+
+
+@st.fragment(run_every=10)
+def render_status():
+    """顶部状态指示灯，按自己的节奏刷新（模型按需加载后也能及时变化）"""
+    status = cached_status()
+    # 模型首次查询/索引时才加载，加载前显示中性的“未加载”状态而不是错误
+    if status.get('models_initialized'):
+        models_class = 'status-ok'
+    elif status.get('models_load_failed'):
+        models_class = 'status-error'
+    else:
+        models_class = 'status-pending'
+    st.markdown(f"""
+        <div style="text-align:right; padding-top:10px;">
+            <span class="status-indicator {models_class}"></span> AI模型<br>
+            <span class="status-indicator {'status-ok' if status.get('chroma_connected') else 'status-error'}"></span> 向量库</div>
+    """, unsafe_allow_html=True)
+
+
+def main():
+    init_session_state()
+    pipeline, error = init_pipeline()
+
+    if error:
+        st.error(f"❌ 系统初始化失败: {error}")
+        st.stop()
+
+    # 本次已是整页刷新，清除 fragment 留下的刷新请求
+    st.session_state.pop("full_rerun", None)
+    show_pending_messages()
+
+    sync_kb_list(pipeline)
 
     # ------------------ 顶部栏 ------------------
     col_header, col_status = st.columns([4, 1])
@@ -238,13 +400,7 @@ def main():
         st.title("😺 HardWare RAG")
 
     with col_status:
-        # 状态显示
-        status = resource_manager.get_status()
-        st.markdown(f"""
-            <div style="text-align:right; padding-top:10px;">
-                <span class="status-indicator {'status-ok' if status.get('models_initialized') else 'status-error'}"></span> AI模型<br>
-                <span class="status-indicator {'status-ok' if status.get('chroma_connected') else 'status-error'}"></span> 向量库</div>
-        """, unsafe_allow_html=True)
+        render_status()
 
     # ------------------ 侧边栏 ------------------
     with st.sidebar:
@@ -259,10 +415,10 @@ def main():
         st.divider()
 
         st.markdown(f"**📍 当前知识库:**")
-        if st.session_state.current_kb not in st.session_state.kb_list:
+        if st.session_state.current_kb not in st.session_state.kb_set:
             st.session_state.current_kb = DEFAULT_KB_NAME
-            if DEFAULT_KB_NAME not in st.session_state.kb_list:
-                st.session_state.kb_list.append(DEFAULT_KB_NAME)
+            if DEFAULT_KB_NAME not in st.session_state.kb_set:
+                set_kb_list(st.session_state.kb_list + [DEFAULT_KB_NAME])
 
         selected_kb = st.selectbox(
             "选择知识库",
@@ -273,15 +429,20 @@ def main():
         if selected_kb != st.session_state.current_kb:
             st.session_state.current_kb = selected_kb
             st.session_state.messages = []
-            st.session_state.confirm_delete_file = None
+            st.session_state.chat_history.clear()
             st.rerun()
 
         # 使用 st.expander 实现"下拉展开查看"，而非下拉选择
-        kb_files = pipeline.list_files(st.session_state.current_kb)
-        st.info(f"当前库包含 {len(kb_files)} 个文件")
+        kb_file_count = cached_count_files(pipeline, st.session_state.current_kb, kb_version(st.session_state.current_kb))
+        st.info(f"当前库包含 {kb_file_count} 个文件")
 
-        if kb_files:
+        # 后台上传进度放在侧边栏，切换到对话页也能继续轮询
+        if st.session_state.upload_job is not None:
+            upload_progress()
+
+        if kb_file_count:
             with st.expander("📚 查看库内文档"):
+                kb_files = cached_list_files(pipeline, st.session_state.current_kb, kb_version(st.session_state.current_kb))
                 for f in kb_files:
                     st.markdown(f"- 📄 {f}")
 
@@ -311,10 +472,59 @@ def main():
 
 
 # ==================== Tab 1: 对话界面 ====================
+def split_assistant(content: str) -> Tuple[str, Optional[str]]:
+    """拆分助手回复为 (回答, 来源引用)，没有来源时后者为 None（写入消息时调用一次）"""
+    from src.core.custom_rag_chat import SOURCES_SEPARATOR
+
+    if SOURCES_SEPARATOR not in content:
+        return content, None
+    main_text, source_text = content.split(SOURCES_SEPARATOR, 1)
+    return main_text.strip(), source_text.strip()
+
+
+def stream_to_placeholder(chunks: Iterable[str], placeholder) -> str:
+    """
+    把流式回答写入同一个占位符
+    按时间间隔批量刷新，而不是每个分片都重绘一次
+    """
+    buf = []
+    last_flush = 0.0
+    for chunk in chunks:
+        buf.append(chunk)
+        now = time.monotonic()
+        if now - last_flush >= STREAM_FLUSH_INTERVAL:
+            placeholder.markdown("".join(buf) + "▌")
+            last_flush = now
+
+    text = "".join(buf)
+    placeholder.markdown(text)
+    return text
+
+
+@st.fragment
 def render_chat_tab(pipeline):
+    from src.core.custom_rag_chat import SOURCES_SEPARATOR
+
+    rerun_app_if_requested()
+    show_pending_messages()
+
     st.caption(f"正在使用知识库: `{st.session_state.current_kb}`")
     chat_container = st.container(height=750, border=True)
 
+    st.markdown("---")
+
+    # --- 输入区（先读取输入，新一轮问答与历史在同一次运行中渲染，无需再 rerun）---
+    col_input, col_btn = st.columns([6, 1])
+    with col_input:
+        user_input = st.chat_input("请输入问题...", key="chat_input")
+    with col_btn:
+        st.button("🗑️ 清空", use_container_width=True, on_click=clear_chat_callback)
+
+    if user_input:
+        st.session_state.messages.append({"role": "user", "content": user_input})
+        # 增量维护的 (问题, 回答) 对，不含本轮问题
+        history = list(st.session_state.chat_history)
+
     with chat_container:
         # --- 欢迎语 ---
         if not st.session_state.messages:
@@ -328,87 +538,228 @@ def render_chat_tab(pipeline):
                 unsafe_allow_html=True
             )
         else:
-            # --- 消息渲染 ---
-            for msg in st.session_state.messages:
+            # --- 消息渲染（只渲染最近 visible_window 条，包含本轮用户消息）---
+            messages = st.session_state.messages
+            window = st.session_state.visible_window
+            if len(messages) > window:
+                st.button(
+                    f"⬆️ 加载更早消息 (还有 {len(messages) - window} 条)",
+                    key="load_older_messages",
+                    on_click=load_older_messages_callback
+                )
+
+            for msg in messages[-window:]:
                 role = msg["role"]
                 content = msg["content"]
 
                 if role == "user":
                     # 用户消息
-                    safe_content = content.replace("\n", "<br>")
-                    st.markdown(
-                        f"""
-                        <div class="user-chat-container">
-                            <div class="user-bubble">{safe_content}</div>
-                            <div class="user-avatar">🧑</div> 
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
+                    with st.chat_message("user", avatar="🧑"):
+                        st.markdown(content)
                 else:
                     # 助手消息
                     with st.chat_message("assistant", avatar="😽"):
-                        separator = "**🔍 检索到的上下文:**"
-                        if separator in content:
-                            try:
-                                main_text, source_text = content.split(separator, 1)
-                                st.markdown(main_text.strip())
-                                with st.expander("📚 参考来源"):
-                                    st.markdown(source_text.strip())
-                            except ValueError:
-                                st.markdown(content)
+                        # 写入时已拆分好，重绘时不再扫描全文
+                        if "main" in msg:
+                            main_text, source_text = msg["main"], msg["src"]
                         else:
-                            st.markdown(content)
+                            main_text, source_text = split_assistant(content)
+                        st.markdown(main_text)
+                        if source_text is not None:
+                            with st.expander("📚 参考来源"):
+                                st.markdown(source_text)
+
+        # --- 处理新输入：助手回答（流式输出，来源引用在结束后放入折叠框）---
+        if user_input:
+            with st.chat_message("assistant", avatar="😻"):
+                parts = []
+                # 占位符先显示思考中，第一个分片到达时即被回答替换
+                placeholder = st.empty()
+                placeholder.markdown("⏳ 思考中...")
+                try:
+                    stream_to_placeholder(
+                        split_answer_stream(
+                            cached_query_stream(pipeline, user_input, st.session_state.current_kb, history),
+                            parts
+                        ),
+                        placeholder
+                    )
+                    response = "".join(parts)
+                except Exception as e:
+                    response = f"❌ 系统错误: {str(e)}"
+                    placeholder.error(response)
+
+                main_text, source_text = split_assistant(response)
+                # 模型没有输出回答时，来源引用仍会附加在后面，需按回答部分判断
+                if not main_text.strip():
+                    main_text = EMPTY_REPLY
+                    response = EMPTY_REPLY if source_text is None else f"{EMPTY_REPLY}{SOURCES_SEPARATOR}\n{source_text}"
+                    placeholder.warning(main_text)
+
+                if source_text is not None:
+                    with st.expander("📚 参考来源"):
+                        st.markdown(source_text)
+
+            st.session_state.messages.append(
+                {"role": "assistant", "content": response, "main": main_text, "src": source_text}
+            )
+            if not is_failed_reply(response):
+                st.session_state.chat_history.append((user_input, response))
+            # 限制会话总长度，丢弃最早的消息
+            overflow = len(st.session_state.messages) - MAX_MESSAGES
+            if overflow > 0:
+                del st.session_state.messages[:overflow]
 
-    st.markdown("---")
 
-    # --- 输入区 ---
-    col_input, col_btn = st.columns([6, 1])
-    with col_input:
-        user_input = st.chat_input("请输入问题...", key="chat_input")
-    with col_btn:
-        if st.button("🗑️ 清空", use_container_width=True):
-            st.session_state.messages = []
-            st.rerun()
+# ==================== Tab 2: 管理界面 ====================
+def save_upload_to_temp(uploaded_file, temp_dir: str) -> str:
+    """
+    把上传文件写入临时目录，返回临时路径
+    每个文件单独一个子目录：同批次内可能有同名文件，且需保留原文件名供入库使用
+    """
+    path = os.path.join(tempfile.mkdtemp(dir=temp_dir), uploaded_file.name)
+    with open(path, "wb") as wb:
+        # 分块写入，避免整份文件在内存中再复制一次
+        uploaded_file.seek(0)
+        shutil.copyfileobj(uploaded_file, wb, length=1 << 20)
+    return path
+
+
+def spill_root(required_bytes: int) -> str:
+    """
+    上传临时文件的存放位置：优先使用内存文件系统（tmpfs），
+    不可写或剩余空间不足 required_bytes * TMPFS_HEADROOM 时退回系统临时目录
+    """
+    candidates = ["/dev/shm"]
+    if hasattr(os, "getuid"):
+        candidates.append(f"/run/user/{os.getuid()}")
+    for path in candidates:
+        if not (os.path.isdir(path) and os.access(path, os.W_OK)):
+            continue
+        try:
+            if shutil.disk_usage(path).free >= required_bytes * TMPFS_HEADROOM:
+                return path
+        except OSError:
+            continue
+    return tempfile.gettempdir()
+
+
+def skip_duplicate_uploads(pipeline, files, kb_name: str) -> Tuple[list, List[str]]:
+    """
+    按内容 SHA-256 去重：跳过知识库中已索引的文件以及本批次内的重复文件
+    Returns:
+        Tuple: (需要上传的文件, 被跳过的文件名)
+    """
+    digests = [hashlib.sha256(f.getbuffer()).hexdigest() for f in files]
+    existing = pipeline.list_hashes(kb_name, set(digests))
+
+    new_files, skipped = [], []
+    seen = set()
+    for f, digest in zip(files, digests):
+        if digest in existing or digest in seen:
+            skipped.append(f.name)
+        else:
+            seen.add(digest)
+            new_files.append(f)
+    return new_files, skipped
 
-    # --- 处理新输入 ---
-    if user_input:
-        st.session_state.messages.append({"role": "user", "content": user_input})
 
-        with chat_container:
-            # 1. 用户消息上屏
-            safe_input = user_input.replace("\n", "<br>")
-            st.markdown(
-                f"""
-                <div class="user-chat-container">
-                    <div class="user-bubble">{safe_input}</div>
-                    <div class="user-avatar">🧑</div>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+def run_upload_job(pipeline, temp_dir: str, temp_paths: List[str], kb_name: str, progress: List[int],
+                   response_cache: ResponseCache, versions: CacheVersions) -> str:
+    """
+    后台线程中执行：建立索引、使缓存失效并删除临时目录（不能访问 st.session_state）
+    progress 为 [已完成数, 总数]，由工作线程更新、轮询 fragment 读取
+    缓存失效在任务内完成，即使发起上传的页面已关闭，其他会话也不会读到旧的问答/文件列表
+    """
+    def on_progress(done: int, total: int):
+        progress[0], progress[1] = done, total
 
-            # 2. 助手回答
-            with st.chat_message("assistant", avatar="😻"):
-                with st.spinner("思考中..."):
-                    history = [(m["content"], "") for m in st.session_state.messages if m["role"] == "user"]
-                    response = pipeline.query(user_input, st.session_state.current_kb, history[-5:])
-
-                    separator = "**🔍 检索到的上下文:**"
-                    if separator in response:
-                        main_text, source_text = response.split(separator, 1)
-                        st.markdown(main_text.strip())
-                        with st.expander("📚 参考来源"):
-                            st.markdown(source_text.strip())
-                    else:
-                        st.markdown(response)
-
-        st.session_state.messages.append({"role": "assistant", "content": response})
+    try:
+        # 解析与向量化在管道内部并发执行
+        return pipeline.upload_files(
+            temp_paths,
+            kb_name,
+            batch_size=UPLOAD_EMBED_BATCH_SIZE,
+            progress_callback=on_progress
+        )
+    finally:
+        response_cache.invalidate_kb(kb_name)
+        versions.bump(kb_name)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@st.fragment(run_every=1)
+def upload_progress():
+    """每秒轮询后台上传任务，完成后刷新整页"""
+    job = st.session_state.upload_job
+    if job is None:
+        return
+
+    future = job["future"]
+    if not future.done():
+        done, total = job["progress"]
+        st.progress(done / total if total else 0.0, text=f"⏳ {job['kb']}: 已索引 {done}/{total} 个文件")
+        if st.button("取消上传", key="cancel_upload", use_container_width=True):
+            if future.cancel():
+                shutil.rmtree(job["temp_dir"], ignore_errors=True)
+                st.session_state.upload_job = None
+                st.session_state.toast_msg = "已取消上传"
+                st.rerun()
+            else:
+                st.warning("索引已开始，无法取消")
+        return
+
+    st.session_state.upload_job = None
+    try:
+        res = future.result()
+        st.session_state.toast_msg = res.split('\n')[0]
+    except Exception as e:
+        st.session_state.error_msg = f"❌ 上传失败: {e}"
+    # 缓存已由后台任务失效，这里只刷新显示；侧边栏文件数变化，需要整页刷新
+    st.rerun()
+
+
+@st.dialog("确认删除")
+def confirm_delete_files_dialog(pipeline, kb_name: str, filenames: List[str], editor_key: str):
+    """删除文件确认弹窗（弹窗自身是独立的局部刷新单元）"""
+    st.markdown(f"确认从 **{kb_name}** 删除以下 {len(filenames)} 个文件？此操作不可恢复。")
+    st.caption("、".join(filenames[:10]) + (" 等" if len(filenames) > 10 else ""))
+
+    col_yes, col_no = st.columns([1, 1])
+    if col_yes.button("✓ 确认删除", type="primary", use_container_width=True):
+        with st.spinner("删除中..."):
+            results = pipeline.delete_documents(filenames, kb_name)
+        mark_kb_changed(kb_name)
+        st.session_state.pop(editor_key, None)
+        failed = [r for r in results if "✅" not in r]
+        if failed:
+            st.session_state.error_msg = "\n".join(failed)
+        else:
+            st.session_state.toast_msg = f"已删除 {len(filenames)} 个文件"
+        # 侧边栏文件数变化，需要整页刷新（同时关闭弹窗）
+        st.rerun()
+    if col_no.button("✗ 取消", use_container_width=True):
         st.rerun()
 
 
-# ==================== Tab 2: 管理界面 ====================
+@st.dialog("确认删除")
+def confirm_delete_kb_dialog(pipeline, kb_name: str):
+    """删除知识库确认弹窗"""
+    rerun_app_if_requested()
+    st.markdown(f"确认删除知识库 **{kb_name}** 及其全部文件？此操作不可恢复。")
+
+    col_yes, col_no = st.columns([1, 1])
+    # 删除在回调中执行，回调里可以安全地修改侧边栏选择框的状态
+    col_yes.button("✅ 是", type="primary", use_container_width=True, on_click=delete_kb_confirmed, args=(pipeline, kb_name))
+    if col_no.button("❌ 否", use_container_width=True):
+        st.rerun()
+
+
+@st.fragment
 def render_kb_management_tab(pipeline):
+    rerun_app_if_requested()
+    show_pending_messages()
+
     st.subheader("📚 知识库管理")
 
     # --- 1. 上传区建立索引区 ---
@@ -420,42 +771,64 @@ def render_kb_management_tab(pipeline):
             type=["pdf", "txt", "md", "docx", "html", "csv"]
         )
 
-        if files and st.button("开始上传", type="primary"):
-            with st.status("处理中...", expanded=True) as status:
-                st.write("保存临时文件...")
-                temp_paths = []
-                temp_dir = tempfile.gettempdir()
-                for f in files:
-                    path = os.path.join(temp_dir, f.name)
-                    with open(path, "wb") as wb:
-                        wb.write(f.getbuffer())
-                    temp_paths.append(path)
-
-                st.write("正在建立索引...")
-                res = pipeline.upload_files(temp_paths, st.session_state.current_kb)
-
-                for p in temp_paths:
-                    try:
-                        os.remove(p)
-                    except:
-                        pass
-
-                status.update(label="✅ 完成", state="complete", expanded=False)
-
-            st.success(res.split('\n')[0])
-            time.sleep(1)
-            st.rerun()
+        upload_pending = st.session_state.upload_job is not None
+        if files and st.button("开始上传", type="primary", disabled=upload_pending):
+            kb_name = st.session_state.current_kb
+            new_files, skipped = skip_duplicate_uploads(pipeline, files, kb_name)
+            for name in skipped:
+                st.info(f"跳过已存在: {name}")
+
+            if new_files:
+                # 每批上传一个独立的临时目录，任务结束后整体删除
+                total_bytes = sum(f.size for f in new_files)
+                temp_dir = tempfile.mkdtemp(prefix="hwrag_upload_", dir=spill_root(total_bytes))
+                try:
+                    with ThreadPoolExecutor(max_workers=min(UPLOAD_IO_WORKERS, len(new_files))) as executor:
+                        temp_paths = list(executor.map(lambda f: save_upload_to_temp(f, temp_dir), new_files))
+                except Exception as e:
+                    # 写临时文件失败（如磁盘空间不足）：清理半成品目录，不提交任务
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    st.session_state.error_msg = f"❌ 保存上传文件失败: {e}"
+                    st.rerun(scope="fragment")
+
+                # 索引放到后台线程执行，期间可继续对话、切换页面
+                progress = [0, len(temp_paths)]
+                st.session_state.upload_job = {
+                    "future": get_upload_executor().submit(
+                        run_upload_job, pipeline, temp_dir, temp_paths, kb_name, progress,
+                        get_response_cache(), get_cache_versions()
+                    ),
+                    "kb": kb_name,
+                    "progress": progress,
+                    "temp_dir": temp_dir
+                }
+                if skipped:
+                    st.session_state.toast_msg = f"已跳过 {len(skipped)} 个重复文件"
+                # 整页刷新，让侧边栏开始轮询上传进度
+                st.rerun()
     st.divider()
 
     # --- 2. 列表与切换区 ---
     st.markdown("##### 📁 知识库列表")
 
+    render_create_kb_section(pipeline)
+
+    # --- 知识库列表展示（每个库是独立的局部刷新单元）---
+    for kb in st.session_state.kb_list:
+        render_kb_panel(pipeline, kb)
+
+
+@st.fragment
+def render_create_kb_section(pipeline):
+    """新建知识库区域：展开/取消/校验失败只重绘本区域，创建成功后再整页刷新"""
+    rerun_app_if_requested()
+    show_pending_messages()
+
     col_kbs, col_new = st.columns([9, 1])
     with col_kbs:
         st.caption(f"共有 {len(st.session_state.kb_list)} 个知识库")
     with col_new:
-        if st.button("➕ 新建"):
-            st.session_state.show_create_kb = True
+        st.button("➕ 新建", on_click=set_state_callback, args=("show_create_kb", True))
 
     if st.session_state.show_create_kb:
         with st.container(border=True):
@@ -464,91 +837,76 @@ def render_kb_management_tab(pipeline):
                 st.text_input("输入新知识库名称", placeholder="例如: project_alpha", key="new_kb_name_input")
                 st.form_submit_button("确认创建", on_click=create_kb_callback, args=(pipeline,))
 
-            if st.button("取消", key="cancel_create_kb"):
-                st.session_state.show_create_kb = False
-                st.rerun()
+            st.button("取消", key="cancel_create_kb", on_click=set_state_callback, args=("show_create_kb", False))
+
+
+@st.fragment
+def render_kb_panel(pipeline, kb: str):
+    """单个知识库面板：翻页、勾选、切换显示等操作只重绘本面板"""
+    rerun_app_if_requested()
+
+    file_count = cached_count_files(pipeline, kb, kb_version(kb))
+    is_current = (kb == st.session_state.current_kb)
+
+    with st.expander(f"{'🟢' if is_current else '⚪'} {kb} ({file_count} 文件)", expanded=is_current):
+
+        # --- 文件列表（非当前库按需加载）---
+        show_files = file_count > 0 and (is_current or st.toggle("显示文件列表", key=f"show_files_{kb}"))
+        if show_files:
+            files = cached_list_files(pipeline, kb, kb_version(kb))
+            st.markdown("**📄 文件列表:**")
+
+            # 大库分页，每页最多渲染 FILES_PAGE_SIZE 行
+            total_pages = (len(files) - 1) // FILES_PAGE_SIZE + 1
+            page = 1
+            if total_pages > 1:
+                page = st.number_input(
+                    f"页码 (共 {total_pages} 页)",
+                    min_value=1,
+                    max_value=total_pages,
+                    step=1,
+                    key=f"page_{kb}"
+                )
+            offset = (page - 1) * FILES_PAGE_SIZE
+            page_files = files[offset:offset + FILES_PAGE_SIZE]
+            if total_pages > 1:
+                st.caption(f"显示第 {offset + 1}-{offset + len(page_files)} 个，共 {len(files)} 个文件")
+
+            editor_key = f"ed_{kb}"
+            edited = st.data_editor(
+                pd.DataFrame({"文件名": page_files, "删除": [False] * len(page_files)}),
+                key=editor_key,
+                hide_index=True,
+                use_container_width=True,
+                disabled=["文件名"],
+                column_config={"删除": st.column_config.CheckboxColumn("删除", default=False)}
+            )
+            selected = edited.loc[edited["删除"], "文件名"].tolist()
 
-    # --- 知识库列表展示 ---
-    for kb in st.session_state.kb_list:
-        files = pipeline.list_files(kb)
-        is_current = (kb == st.session_state.current_kb)
-
-        with st.expander(f"{'🟢' if is_current else '⚪'} {kb} ({len(files)} 文件)", expanded=is_current):
-
-            # --- 文件列表 ---
-            if files:
-                st.markdown("**📄 文件列表:**")
-                container_kwargs = {"border": True}
-                if len(files) > 5:
-                    container_kwargs["height"] = 300
-
-                with st.container(**container_kwargs):
-                    for f in files:
-                        c1, c2 = st.columns([0.80, 0.20])
-                        with c1:
-                            st.text(f)
-                        with c2:
-                            current_confirm = st.session_state.confirm_delete_file
-                            is_confirming = (current_confirm == (kb, f))
-
-                            if is_confirming:
-                                sub_c1, sub_c2 = st.columns([1, 1])
-                                with sub_c1:
-                                    if st.button("✓", key=f"yes_f_{kb}_{f}", help="确认删除"):
-                                        with st.spinner("删除中..."):
-                                            res = pipeline.delete_document(f, kb)
-                                            st.session_state.confirm_delete_file = None
-                                            if "✅" in res:
-                                                st.session_state.toast_msg = f"已删除: {f}"
-                                            else:
-                                                st.session_state.error_msg = res
-                                            st.rerun()
-                                with sub_c2:
-                                    if st.button("✗", key=f"no_f_{kb}_{f}", help="取消"):
-                                        st.session_state.confirm_delete_file = None
-                                        st.rerun()
-                            else:
-                                if st.button("🗑️", key=f"del_f_{kb}_{f}", help="删除文件"):
-                                    st.session_state.confirm_delete_file = (kb, f)
-                                    st.rerun()
+            if st.button(f"🗑️ 删除选中 ({len(selected)})", key=f"del_f_{kb}", disabled=not selected):
+                confirm_delete_files_dialog(pipeline, kb, selected, editor_key)
+        elif not file_count:
+            st.caption("暂无文件")
+
+        st.divider()
+
+        # --- 底部按钮 ---
+        col_switch, col_del = st.columns([1, 1])
+        with col_switch:
+            if not is_current:
+                st.button(
+                    "🔄 切换到此知识库",
+                    key=f"btn_switch_{kb}",
+                    on_click=switch_kb_callback,
+                    args=(kb,)
+                )
             else:
-                st.caption("暂无文件")
-
-            st.divider()
-
-            # --- 底部按钮 ---
-            col_switch, col_del = st.columns([1, 1])
-            with col_switch:
-                if not is_current:
-                    st.button(
-                        "🔄 切换到此知识库",
-                        key=f"btn_switch_{kb}",
-                        on_click=switch_kb_callback,
-                        args=(kb,)
-                    )
-                else:
-                    st.button("✅ 当前使用中", disabled=True, key=f"btn_cur_{kb}")
-
-            with col_del:
-                if kb != DEFAULT_KB_NAME:
-                    if st.session_state.confirm_delete_kb == kb:
-                        st.markdown("**确认删除?**")
-                        sub_c1, sub_c2 = st.columns([1, 1])
-                        with sub_c1:
-                            st.button(
-                                "✅ 是",
-                                key=f"yes_kb_{kb}",
-                                on_click=delete_kb_confirmed,
-                                args=(pipeline, kb)
-                            )
-                        with sub_c2:
-                            if st.button("❌ 否", key=f"no_kb_{kb}"):
-                                st.session_state.confirm_delete_kb = None
-                                st.rerun()
-                    else:
-                        if st.button("🗑️ 删除整个库", key=f"del_kb_{kb}"):
-                            st.session_state.confirm_delete_kb = kb
-                            st.rerun()
+                st.button("✅ 当前使用中", disabled=True, key=f"btn_cur_{kb}")
+
+        with col_del:
+            if kb != DEFAULT_KB_NAME:
+                if st.button("🗑️ 删除整个库", key=f"del_kb_{kb}"):
+                    confirm_delete_kb_dialog(pipeline, kb)
 
 
 if __name__ == "__main__":